@@ -1,225 +1,330 @@
+import io
 import json
-import argparse
+import contextlib
+import copy
+import mmap
 import os
-import shutil
+import sys
+import tempfile
 
-from pathlib import Path
+try: import orjson # Optional, much faster JSON parsing/serializing
+except ImportError: orjson = None
 
 VERSION = "v0.1"
-INSTALLED_JSON = 'data/installed.json'
+INSTALLED_JSON = 'data/installed.json' # Default; TINYHOOK_INSTALLED_JSON overrides it, see installed_json()
 REPO_JSON = 'repo.json'
+PACKAGE_SOURCE_PREFIX = '/data/packages/'
+PACKAGE_INSTALL_PREFIX = 'data/packages/'
+
+USE_MMAP = os.environ.get("TINYHOOK_MMAP") == "1" # Opt-in: mmap only pays off for large DBs
+MMAP_MIN_SIZE = 4096
+
+_db_cache = {} # path -> (db_stamp, parsed data)
 
 ########################################
 # Database Control
 ########################################
 
 def init_db(file_location):
-    if not os.path.exists(file_location):
-        with open(file_location, "w") as f:
-            json.dump({}, f, indent=2)
-
+    # O_EXCL creates the file only if it is missing, without a separate exists() check
+    try: fd = os.open(file_location, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666) # Mode still masked by the umask
+    except FileExistsError: return
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"{}")
+
+def installed_json():
+    # Read at call time so setting the variable after import still redirects the DB
+    return os.environ.get("TINYHOOK_INSTALLED_JSON", INSTALLED_JSON)
+
+# ctime can't be reset by utime() and os.replace() changes the inode, so same-size rewrites within one mtime tick still miss the cache
+def db_stamp(file_location):
+    stat = os.stat(file_location)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns
+
+# Mode for a rewritten DB: keep the existing file's permissions, otherwise 0o666 masked by the umask like open() would
+def db_mode(file_location):
+    try: return os.stat(file_location).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+# Parses are cached while the file is unchanged; callers get a deep copy, so no edit to the result can reach the cache.
+# A missing or empty file reads as {}; None means the file exists but could not be read or parsed.
 def read_db(file_location):
     try:
-        with open(file_location, "r") as f:
-            return json.load(f)
-    except: print(f"File '{file_location}' not found.")
+        stamp = db_stamp(file_location)
+        cached = _db_cache.get(file_location)
+        if cached and cached[0] == stamp: return copy.deepcopy(cached[1])
+
+        if stamp[1] == 0: data = {}
+        else:
+            with open(file_location, "rb") as f:
+                if orjson and USE_MMAP and stamp[1] > MMAP_MIN_SIZE:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                        data = orjson.loads(view)
+                else:
+                    data = orjson.loads(f.read()) if orjson else json.load(f)
+        _db_cache[file_location] = (stamp, data)
+        return copy.deepcopy(data)
+    except FileNotFoundError:
+        print(f"File '{file_location}' not found.")
+        return {}
+    except ValueError: # json/orjson JSONDecodeError
+        print(f"File '{file_location}' is not valid JSON.")
+    except OSError as e:
+        print(f"Could not read '{file_location}': {e.strerror}")
+    return None
     
+# Returns True once the data is on disk, False (after printing why) if nothing was written
 def write_db(data, file_location):
+    if data is None:
+        print(f"Data empty")
+        return False
+    if file_location is None:
+        print(f"File '{file_location}' not found")
+        return False
+
+    # Write to a uniquely named temporary file and swap it in, so neither a crash nor a concurrent writer leaves a torn DB
+    tmp_location = None
     try:
-        with open(file_location, "w") as f:
-            json.dump(data, f, indent=2)
-    except: 
-        if data is None: print(f"Data empty")
-        if file_location is None: print(f"File '{file_location}' not found")
+        # Serialize before creating the temporary file so a bad payload never leaves one behind
+        if orjson: payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        else: payload = json.dumps(data, indent=2).encode()
+
+        db_dir, db_name = os.path.split(file_location)
+        fd, tmp_location = tempfile.mkstemp(dir=db_dir or ".", prefix=f"{db_name}.", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_location, db_mode(file_location)) # mkstemp creates files as 0o600
+        os.replace(tmp_location, file_location)
+        # Cache what was actually written rather than the caller's object, which it may keep editing
+        _db_cache[file_location] = (db_stamp(file_location), orjson.loads(payload) if orjson else json.loads(payload))
+        return True
+    except (TypeError, ValueError) as e: # Not JSON serializable (orjson raises TypeError, stdlib json also ValueError)
+        _db_cache.pop(file_location, None)
+        print(f"Could not serialize data for '{file_location}': {e}")
+    except OSError as e:
+        _db_cache.pop(file_location, None)
+        if tmp_location:
+            try: os.unlink(tmp_location)
+            except FileNotFoundError: pass
+        print(f"Could not write '{file_location}': {e.strerror}")
+    return False
 
 def is_installed(name):
-    try:
-        with open(INSTALLED_JSON, "r") as f:
-            data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        data = {}
-    return name in data
-
-def get_package_info(package_name, file_data_location=REPO_JSON):
-    data = read_db(file_data_location)
+    return name in (read_db(installed_json()) or {})
 
-    if package_name in data.get("packages", {}):
-        return data["packages"][package_name]
-    else:
-        return None
+def make_package_entry(package_name, version="1.0"):
+    return {
+        "version": version,
+        "installed_at": "2025-11-04T12:00:00Z",
+        "source_type": "local_path",
+        "source_value": PACKAGE_SOURCE_PREFIX + package_name,
+        "install_path": PACKAGE_INSTALL_PREFIX + package_name
+    }
 
-init_db(INSTALLED_JSON)
+def get_package_info(package_name, file_data_location=REPO_JSON):
+    return (read_db(file_data_location) or {}).get("packages", {}).get(package_name)
 
 ########################################
 # Argument Parsing
 ########################################
 
-parser = argparse.ArgumentParser(prog="tinyhook", description="TinyHook Package Utils - A minimal package manager")
-parser.add_argument(
-    "--sandbox",
-    action="store_true",
-    help="Run Sandbox™ code"
-
-)
-parser.add_argument(
-    "-v", "--version",
-    action="store_true",
-    help="Show TinyHook version"
-)
-parser.add_argument(
-    "--debug",
-    action="store_true",
-    help="Enable debug mode"
-)
-parser.add_argument(
-    "--dry-run",
-    action="store_true",
-    help="Simulates action without executing it"
-)
-parser.add_argument(
-    "-q", "--quiet",
-    action="store_true",
-    help="Supresses normal output behavior"
-)
-
-subparsers = parser.add_subparsers(dest="command")
-
-hook_parser = subparsers.add_parser("hook", help="Install a package")
-hook_parser.add_argument("package_name", help="Name of the package to install")
-hook_parser.add_argument(
-    "--dry-run",
-    action="store_true",
-    help="Simulate installation without performing it"
-)
-hook_parser.add_argument(
-    "-q", "--quiet",
-    action="store_true",
-    help="Supresses normal output behavior"
-)
-
-run_parser = subparsers.add_parser("run", help="Run an installed package")
-run_parser.add_argument("package_name", help="Name of the package to run")
-run_parser.add_argument(
-    "--dry-run",
-    action="store_true",
-    help="Simulates action without executing it"
-)
-run_parser.add_argument(
-    "-q", "--quiet",
-    action="store_true",
-    help="Supresses normal output behavior"
-)
-
-list_parser = subparsers.add_parser("list", help="List installed packages")
-
-remove_parser = subparsers.add_parser("remove", help="Removes a package")
-remove_parser.add_argument("package_name", help="Name of the package to remove")
-remove_parser.add_argument(
-    "--dry-run",
-    action="store_true",
-    help="Simulates action without executing it"
-)
-remove_parser.add_argument(
-    "-q", "--quiet",
-    action="store_true",
-    help="Supresses normal output behavior"
-)
-
-
-args = parser.parse_args()
-
-if args.version:
-    print(f"TinyHook {VERSION} - Dev Build")
-
-# elif args.command == "hook":
-#     if args.quiet: pass
-#     elif args.dry_run: print(f"[Dry Run] Would hook {args.package_name}")
-
-#     else: print(f"Hooking {args.package_name}...")
-
-# elif args.command == "run":
-#     if args.quiet: pass
-#     elif args.dry_run: print(f"[Dry Run] Would run {args.package_name}")
-
-#     else: print(f"Running {args.package_name}...")
-
-
-# elif args.command == "list":
-#     if args.quiet: pass
-#     elif args.dry_run: print("[Dry Run] Would list installed packages")
-    
-#     else: print("Listing installed packages...")
-
-# else:
-#     parser.print_help()
-
+def build_parser(command=None):
+    import argparse # Deferred: only needed once we know argv isn't a plain version query
+
+    parser = argparse.ArgumentParser(prog="tinyhook", description="TinyHook Package Utils - A minimal package manager")
+    parser.add_argument(
+        "--sandbox",
+        action="store_true",
+        help="Run Sandbox™ code"
+
+    )
+    parser.add_argument(
+        "-v", "--version",
+        action="store_true",
+        help="Show TinyHook version"
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Enable debug mode"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Simulates action without executing it"
+    )
+    parser.add_argument(
+        "-q", "--quiet",
+        action="store_true",
+        help="Supresses normal output behavior"
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    hook_parser = subparsers.add_parser("hook", help="Install a package")
+    run_parser = subparsers.add_parser("run", help="Run an installed package")
+    list_parser = subparsers.add_parser("list", help="List installed packages")
+    remove_parser = subparsers.add_parser("remove", help="Removes a package")
+
+    # Only the invoked subcommand is ever parsed, so the others are left without arguments
+    if command == "hook":
+        hook_parser.add_argument("package_name", help="Name of the package to install")
+        hook_parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Simulate installation without performing it"
+        )
+        hook_parser.add_argument(
+            "-q", "--quiet",
+            action="store_true",
+            help="Supresses normal output behavior"
+        )
+
+    elif command == "run":
+        run_parser.add_argument("package_name", help="Name of the package to run")
+        run_parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Simulates action without executing it"
+        )
+        run_parser.add_argument(
+            "-q", "--quiet",
+            action="store_true",
+            help="Supresses normal output behavior"
+        )
+
+    elif command == "remove":
+        remove_parser.add_argument("package_name", help="Name of the package to remove")
+        remove_parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Simulates action without executing it"
+        )
+        remove_parser.add_argument(
+            "-q", "--quiet",
+            action="store_true",
+            help="Supresses normal output behavior"
+        )
+
+    return parser
 
 ########################################
 # Command Logic
 ########################################
 
-if args.command == "hook":
-    package_name = args.package_name
-    with open(INSTALLED_JSON, "r") as f:
-        installed_data = json.load(f)
-    
-    if is_installed(package_name): print(f"{package_name} is already installed!")
-    else:
-        new_entry = {
-            package_name: {
-                "version": "1.0",
-                "installed_at": "2025-11-04T12:00:00Z",
-                "source_type": "local_path",
-                "source_value": f"/data/packages/{package_name}",
-                "install_path": f"data/packages/{package_name}"
-            }
-        }
-
-        if args.dry_run:
-            print(f"[Dry Run] Would hook {package_name}")
+def main():
+    # Fast path: answer a bare version query without building the argument parser
+    if sys.argv[1:] in (["-v"], ["--version"]):
+        print(f"TinyHook {VERSION} - Dev Build")
+        return 0
+
+    command = next((arg for arg in sys.argv[1:] if not arg.startswith("-")), None)
+    parser = build_parser(command)
+    args = parser.parse_args()
+    db_location = installed_json()
+    status = 0 # Exit code: 1 when the DB could not be read or written
+
+    if args.version:
+        print(f"TinyHook {VERSION} - Dev Build")
+
+    # elif args.command == "hook":
+    #     if args.quiet: pass
+    #     elif args.dry_run: print(f"[Dry Run] Would hook {args.package_name}")
+
+    #     else: print(f"Hooking {args.package_name}...")
+
+    # elif args.command == "run":
+    #     if args.quiet: pass
+    #     elif args.dry_run: print(f"[Dry Run] Would run {args.package_name}")
+
+    #     else: print(f"Running {args.package_name}...")
+
+
+    # elif args.command == "list":
+    #     if args.quiet: pass
+    #     elif args.dry_run: print("[Dry Run] Would list installed packages")
+
+    #     else: print("Listing installed packages...")
+
+    # else:
+    #     parser.print_help()
+
+    if args.command == "hook":
+        init_db(db_location)
+        package_name = args.package_name
+        installed_data = read_db(db_location)
+
+        if installed_data is None: status = 1 # Never overwrite a DB that could not be read
+
+        elif package_name in installed_data: print(f"{package_name} is already installed!")
         else:
-            installed_data.update(new_entry)
-            write_db(installed_data, INSTALLED_JSON)
-            if not args.quiet: print(f"Successfully hooked '{package_name}'!")
+            if args.dry_run:
+                print(f"[Dry Run] Would hook {package_name}")
+            else:
+                installed_data[package_name] = make_package_entry(package_name)
+                if not write_db(installed_data, db_location): status = 1
+                elif not args.quiet: print(f"Successfully hooked '{package_name}'!")
 
-elif args.command == "run":
-    package_name = args.package_name
+    elif args.command == "run":
+        init_db(db_location)
+        package_name = args.package_name
+        installed_data = read_db(db_location)
 
-    if not is_installed(package_name): print(f"{package_name} is not installed!")
-    
-    elif args.dry_run: print(f"[Dry Run] Would run {package_name}")
+        if installed_data is None: status = 1 # read_db already reported why it could not be read
 
-    else: print(f"Running {package_name}")
+        elif package_name not in installed_data: print(f"{package_name} is not installed!")
 
-elif args.command == "list":
-    installed_data = read_db(INSTALLED_JSON)
+        elif args.dry_run: print(f"[Dry Run] Would run {package_name}")
 
-    if not installed_data: print("No packages installed.") # If no packages are installed
-    
-    elif args.dry_run: print("[Dry Run] Would list packages and version")
+        else: print(f"Running {package_name}")
 
-    else: 
-        for pkg, info in installed_data.items():
-            print(f"{pkg} - version {info['version']}")
+    elif args.command == "list":
+        init_db(db_location)
+        installed_data = read_db(db_location)
 
-elif args.command == "remove":
-    package_name = args.package_name
-    installed_data = read_db(INSTALLED_JSON)
+        if installed_data is None: status = 1 # read_db already reported why it could not be read
 
-    if not installed_data: print("No packages installed")
+        elif not installed_data: print("No packages installed.") # If no packages are installed
 
-    elif args.dry_run and not args.quiet: print(f"[Dry Run] Would remove {package_name}")
+        elif args.dry_run: print("[Dry Run] Would list packages and version")
 
-    elif not package_name in installed_data: print(f"Package '{package_name}' is not found")
+        else: 
+            # One write for the whole listing instead of a print() per package
+            sys.stdout.write("".join(f"{pkg} - version {info['version']}\n" for pkg, info in installed_data.items()))
 
-    else:
-        deleted = installed_data.pop(package_name)
-        write_db(installed_data, INSTALLED_JSON)
-        if not args.quiet: print(f"Successfully removed '{package_name}'!")
+    elif args.command == "remove":
+        init_db(db_location)
+        package_name = args.package_name
+        installed_data = read_db(db_location)
+
+        if installed_data is None: status = 1 # read_db already reported why it could not be read
+
+        elif not installed_data: print("No packages installed")
+
+        elif args.dry_run and not args.quiet: print(f"[Dry Run] Would remove {package_name}")
+
+        elif not package_name in installed_data: print(f"Package '{package_name}' is not found")
+
+        else:
+            deleted = installed_data.pop(package_name)
+            if not write_db(installed_data, db_location): status = 1
+            elif not args.quiet: print(f"Successfully removed '{package_name}'!")
+
+    elif not args.version:
+        parser.print_help()
+
+    if args.sandbox:
+        init_db(db_location)
+        sandbox = Sandbox("tinyhook", args=args)
+        sandbox.run()
+
+    return status
 
-else:
-    parser.print_help()
-    
 
 
 
@@ -243,8 +348,9 @@ else:
 #########################################################
 
 class Sandbox:
-    def __init__(self, name, should_auto_instance=False):
+    def __init__(self, name, should_auto_instance=False, args=None):
         self.name = name
+        self.args = args
         print(f"============ Sandbox: {self.name} ============")
         print(f"Welcome to Sandbox™!\n\nThe following are instances of Sandbox™ code written inside the Sandbox™ class\nfor Sandbox '{self.name}'")
         self.instance_count = 0
@@ -257,24 +363,36 @@ class Sandbox:
         print(f"Output: ")
 
     def run(self):
+        # Case output is collected and written out in one go once all cases have run
+        buffer = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(buffer):
+                self.run_cases()
+        finally:
+            sys.stdout.write(buffer.getvalue())
+            sys.stdout.flush()
+
+    def run_cases(self):
         print("Hello world! learning concept tests here.")
+        db_location = installed_json()
 
 
         self.new_instance("Reading data")
-        data = read_db(INSTALLED_JSON)
+        data = read_db(db_location)
         print(data)
 
 
         self.new_instance("Writing data (Updating)")
         new_data = {"hello": {"version": "1.0"}}
-        if not is_installed("hello"): data.update(new_data)
-        write_db(data, INSTALLED_JSON)
-        print(read_db(INSTALLED_JSON))
+        if data is None: print("[Failure] Installed data could not be read")
+        else:
+            if not is_installed("hello"): data.update(new_data)
+            if write_db(data, db_location): print(read_db(db_location))
 
 
         self.new_instance("Accessing arguments for hook")
         try: 
-            package_name = args.package_name
+            package_name = self.args.package_name
             print(package_name)
         except: print("[Failure] No arguments provided")
 
@@ -287,6 +405,5 @@ class Sandbox:
             print("Package not found in repos")
 
 
-if args.sandbox:
-    sandbox = Sandbox("tinyhook")
-    sandbox.run()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())